@@ -0,0 +1,120 @@
+"""Benchmark reading and rewriting pyproject.toml files.
+
+Compares the `toml` package against the standard library parser for reading,
+and a full `toml.dumps` against the span-based patcher for writing. Every
+dependency of every file is rewritten the way a downgrade would rewrite it.
+Reading with the patcher includes keeping a snapshot of the parsed document,
+as the command-line interface does, so the read + write totals compare the
+whole round trip.
+
+Usage: python benchmarks/toml_roundtrip.py path/to/pyprojects/ [more paths...]
+"""
+
+from __future__ import annotations
+import copy
+import difflib
+from pathlib import Path
+import time
+from typing import Any, Callable
+
+import click
+import toml
+
+from poetry_python_downgrader.cli import get_dependencies, get_group_dependencies
+from poetry_python_downgrader.read_toml import TomlSource, loads_toml
+from poetry_python_downgrader.write_toml import dumps_toml
+
+
+def find_pyprojects(paths: tuple[Path, ...]) -> list[Path]:
+    """Expand directories into the pyproject.toml files they contain."""
+    found: list[Path] = []
+    for path in paths:
+        if path.is_dir():
+            found.extend(sorted(path.rglob("pyproject.toml")))
+        else:
+            found.append(path)
+    return found
+
+
+def simulate_downgrade(pyproject: dict) -> dict:
+    """Rewrite every dependency constraint, as a downgrade would."""
+    updated = copy.deepcopy(pyproject)
+    poetry_config = updated.get("tool", {}).get("poetry", {})
+    for dependencies in [get_dependencies(poetry_config)] + get_group_dependencies(
+        poetry_config
+    ):
+        for package, constraint in dependencies.items():
+            if isinstance(constraint, str):
+                dependencies[package] = "^0.1.0"
+            elif isinstance(constraint, dict) and "version" in constraint:
+                constraint["version"] = "^0.1.0"
+        dependencies["python"] = "^3.8"
+    return updated
+
+
+def changed_lines(before: str, after: str) -> int:
+    """Count the lines added or removed between two texts."""
+    return sum(
+        1
+        for line in difflib.unified_diff(before.splitlines(), after.splitlines(), n=0)
+        if line[:1] in "+-" and line[:3] not in ("+++", "---")
+    )
+
+
+def read_source(text: str) -> TomlSource:
+    """Parse a TOML text, keeping a snapshot as the command-line interface does."""
+    return TomlSource(text, loads_toml(text))
+
+
+def timed(function: Callable[..., object], *args: Any, repeat: int = 5) -> float:
+    """Time the fastest of a few calls of a function."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@click.command()
+@click.argument("paths", nargs=-1, required=True, type=click.Path(path_type=Path))
+def main(paths: tuple[Path, ...]) -> None:
+    """Benchmark TOML reading and writing over a set of pyproject files."""
+    totals = dict.fromkeys(
+        ("toml.loads", "TomlSource", "toml.dumps", "dumps_toml"), 0.0
+    )
+    diff_dump = diff_patch = files = skipped = 0
+
+    for path in find_pyprojects(paths):
+        text = path.read_text(encoding="utf-8")
+        try:
+            pyproject = loads_toml(text)
+            toml.loads(text)
+        except (ValueError, IndexError):
+            # The toml package fails on some valid documents; compare like for like
+            skipped += 1
+            continue
+        updated = simulate_downgrade(pyproject)
+        files += 1
+
+        totals["toml.loads"] += timed(toml.loads, text)
+        totals["TomlSource"] += timed(read_source, text)
+        totals["toml.dumps"] += timed(toml.dumps, updated)
+        totals["dumps_toml"] += timed(dumps_toml, updated, text, pyproject)
+
+        diff_dump += changed_lines(text, toml.dumps(updated))
+        diff_patch += changed_lines(text, dumps_toml(updated, text, pyproject))
+
+    click.echo(f"{files} pyproject files ({skipped} skipped as unparseable)")
+    for name, total in totals.items():
+        click.echo(f"{name:>12}: {total * 1000:9.2f} ms")
+    baseline = totals["toml.loads"] + totals["toml.dumps"]
+    patched = totals["TomlSource"] + totals["dumps_toml"]
+    click.echo(f"Read + write with toml:       {baseline * 1000:9.2f} ms")
+    click.echo(f"Read + write with dumps_toml: {patched * 1000:9.2f} ms")
+    click.echo(f"Changed lines with toml.dumps: {diff_dump}")
+    click.echo(f"Changed lines with dumps_toml: {diff_patch}")
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -3,5 +3,6 @@
 from .downgrader import downgrade_packages
 from .pypi import get_compatible_versions
 from .read_toml import read_toml
+from .write_toml import dumps_toml
 
-__all__ = ["downgrade_packages", "get_compatible_versions", "read_toml"]
+__all__ = ["downgrade_packages", "dumps_toml", "get_compatible_versions", "read_toml"]
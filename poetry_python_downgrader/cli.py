@@ -5,18 +5,21 @@ import asyncio
 import logging
 from pathlib import Path
 import sys
-from typing import Coroutine
+from typing import Coroutine, TextIO
 
 import click
 from poetry.core.constraints.version import Version, parse_constraint
-import toml
 
 from .downgrader import downgrade_packages
-from .read_toml import read_toml
+from .pypi import MetadataCache
+from .read_toml import TomlSource, read_toml_source
+from .write_toml import dumps_toml
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
 
+CACHE_DIR_ENVVAR = "POETRY_PYTHON_DOWNGRADER_CACHE_DIR"
+
 
 # Version checking functions
 def supports_version(constraint: str, version: str) -> bool:
@@ -51,22 +54,35 @@ def get_group_dependencies(poetry_config: dict) -> list[dict]:
     ]
 
 
+def get_named_dependency_groups(poetry_config: dict) -> list[tuple[str, dict]]:
+    """Get the main dependencies and those of each group, with the group name."""
+    return [("main", get_dependencies(poetry_config))] + [
+        (name, group.get("dependencies", {}))
+        for name, group in poetry_config.get("group", {}).items()
+    ]
+
+
 # Task creation and execution
-def create_downgrade_tasks(
-    dependencies: dict,
-    group_dependencies: list[dict],
+def create_downgrade_tasks(  # pylint: disable=too-many-arguments
+    dependency_groups: list[tuple[str, dict]],
     target_python_version: str,
     pin_versions: bool,
     repository: str,
+    cache: MetadataCache | None = None,
+    explain: TextIO | None = None,
 ) -> list[Coroutine]:
-    """Create downgrade tasks for main and group dependencies."""
+    """Create downgrade tasks for the main dependencies and each named group."""
     return [
         downgrade_packages(
-            dependencies, target_python_version, pin_versions, repository
+            dependencies,
+            target_python_version,
+            pin_versions,
+            repository,
+            cache,
+            explain,
+            group,
         )
-    ] + [
-        downgrade_packages(group, target_python_version, pin_versions, repository)
-        for group in group_dependencies
+        for group, dependencies in dependency_groups
     ]
 
 
@@ -76,13 +92,21 @@ async def run_tasks(tasks: list[Coroutine]) -> None:
 
 
 # File operations
+def render_pyproject(pyproject: TomlSource) -> str:
+    """Render the updated pyproject, preserving the formatting of the source file."""
+    return dumps_toml(pyproject.document, pyproject.text, pyproject.original)
+
+
 def write_output(
-    pyproject: dict, output_path: Path, target_python_version: str
+    pyproject: TomlSource,
+    output_path: Path,
+    target_python_version: str,
 ) -> None:
     """Write the updated pyproject to the output file."""
     try:
-        with output_path.open("w") as f:
-            toml.dump(pyproject, f)
+        content = render_pyproject(pyproject)
+        with output_path.open("w", encoding="utf-8", newline="") as f:
+            f.write(content)
         click.echo(
             f"Updated {output_path} for Python {target_python_version}", err=True
         )
@@ -100,18 +124,20 @@ def print_to_stdout(pyproject_path: Path) -> None:
 
 
 # Main logic
-def process_pyproject(
+def process_pyproject(  # pylint: disable=too-many-arguments
     pyproject_path: Path,
     target_python_version: str,
     pin_versions: bool,
     repository: str,
-) -> dict | None:
+    cache: MetadataCache | None = None,
+    explain: TextIO | None = None,
+) -> TomlSource | None:
     """Process the pyproject file and return the updated config if needed."""
-    pyproject = read_toml(pyproject_path)
+    pyproject = read_toml_source(pyproject_path)
     if pyproject is None:
         return None
 
-    poetry_config = get_poetry_config(pyproject)
+    poetry_config = get_poetry_config(pyproject.document)
 
     if supports_python_version(poetry_config, target_python_version):
         click.echo(
@@ -119,15 +145,13 @@ def process_pyproject(
         )
         return None
 
-    dependencies = get_dependencies(poetry_config)
-    group_dependencies = get_group_dependencies(poetry_config)
-
     downgrade_tasks = create_downgrade_tasks(
-        dependencies,
-        group_dependencies,
+        get_named_dependency_groups(poetry_config),
         target_python_version,
         pin_versions,
         repository,
+        cache or MetadataCache(),
+        explain,
     )
     asyncio.run(run_tasks(downgrade_tasks))
 
@@ -165,20 +189,55 @@ def process_pyproject(
     help="Custom repository URL",
     default="https://pypi.org/pypi",
 )
-def main(  # pylint: disable=too-many-arguments
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    envvar=CACHE_DIR_ENVVAR,
+    help="Directory to cache package metadata in; see prefetch-pyproject-metadata",
+    default=None,
+)
+@click.option(
+    "--negative-cache/--no-negative-cache",
+    is_flag=True,
+    help="Trust cached 'not found' and 'no compatible release' results; "
+    "only applies with --cache-dir",
+    default=True,
+)
+@click.option(
+    "--explain",
+    type=click.File("w"),
+    help="Write a JSON line explaining every decision to this file; "
+    "'-' for stdout, when writing the pyproject with -o or -i",
+    default=None,
+)
+def main(  # pylint: disable=too-many-arguments  # noqa: CFQ002
     pyproject_path: Path,
     target_python_version: str,
     output: Path | None,
     in_place: bool,
     pin_versions: bool,
     repository: str,
+    cache_dir: Path | None,
+    negative_cache: bool,
+    explain: TextIO | None,
 ) -> None:
     """Downgrade packages in pyproject.toml to be compatible with a specific Python version."""
     if output is not None and in_place:
         raise click.UsageError("Cannot use both --output and --in-place")
+    explain_to_stdout = explain is not None and explain.name == "<stdout>"
+    if explain_to_stdout and output is None and not in_place:
+        raise click.UsageError(
+            "Cannot write --explain to stdout along with the pyproject; "
+            "use --output or --in-place"
+        )
 
     updated_pyproject = process_pyproject(
-        pyproject_path, target_python_version, pin_versions, repository
+        pyproject_path,
+        target_python_version,
+        pin_versions,
+        repository,
+        MetadataCache(cache_dir, negative_cache),
+        explain,
     )
 
     if updated_pyproject is None:
@@ -190,7 +249,7 @@ def main(  # pylint: disable=too-many-arguments
         output = pyproject_path
 
     if output is None:
-        click.echo(toml.dumps(updated_pyproject))
+        click.echo(render_pyproject(updated_pyproject))
     else:
         write_output(updated_pyproject, output, target_python_version)
 
@@ -2,21 +2,132 @@
 
 from __future__ import annotations
 import asyncio
+from dataclasses import dataclass, field
+import json
 import logging
-from typing import Any, Awaitable
+from typing import Any, Awaitable, TextIO, TYPE_CHECKING
 
 from poetry.core.constraints.version import Version, parse_constraint
+from poetry.core.version.markers import parse_marker
 
-from .pypi import get_compatible_versions
+from .pypi import (
+    LookupTracer,
+    Reason,
+    VersionLookup,
+    empty_trace,
+    lookup_compatible_versions,
+)
+
+if TYPE_CHECKING:
+    from .pypi import MetadataCache
 
 logger = logging.getLogger(__name__)
 
+REMOVAL_MESSAGES = {
+    Reason.NOT_FOUND: "Removing %s as it was not found in the repository",
+    Reason.NO_COMPATIBLE_RELEASE: "Removing %s as no compatible version found",
+}
+
+
+def get_branches(constraint: Any) -> list[Any]:
+    """Get the constraints of a dependency; multiple-constraint ones have several."""
+    return constraint if isinstance(constraint, list) else [constraint]
+
 
 def get_constraint(constraint: Any) -> str | None:
     """Get the version constraint from a dependency."""
     return constraint if isinstance(constraint, str) else constraint.get("version")
 
 
+def python_environment(target_python_version: str) -> dict[str, str]:
+    """Get the marker environment describing the target Python version."""
+    version = Version.parse(target_python_version)
+    environment = {"python_version": f"{version.major}.{version.minor}"}
+    if version.patch is not None:
+        environment["python_full_version"] = target_python_version
+    return environment
+
+
+def allows_python(constraint: Any, target_python_version: str) -> bool:
+    """Check if the python and marker restrictions of a constraint allow the target."""
+    if not isinstance(constraint, dict):
+        return True
+
+    python = constraint.get("python")
+    if python is not None and not parse_constraint(python).allows(
+        Version.parse(target_python_version)
+    ):
+        return False
+
+    markers = constraint.get("markers")
+    return markers is None or parse_marker(markers).validate(
+        python_environment(target_python_version)
+    )
+
+
+@dataclass
+class Explainer:
+    """Writes a JSON line describing every decision taken, with lookup traces."""
+
+    stream: TextIO
+    target_python_version: str
+    group: str = "main"
+    tracer: LookupTracer = field(default_factory=LookupTracer)
+
+    def write(  # pylint: disable=too-many-arguments
+        self,
+        package: str,
+        constraint: str | None,
+        decision: str,
+        reason: str,
+        trace: dict[str, Any] | None = None,
+    ) -> None:
+        """Write a JSON line describing the decision taken for a constraint."""
+        record = {
+            "package": package,
+            "group": self.group,
+            "constraint": constraint,
+            "python": self.target_python_version,
+            "decision": decision,
+            "reason": reason,
+            **(empty_trace() if trace is None else trace),
+        }
+        self.stream.write(json.dumps(record) + "\n")
+
+
+def prune_dependencies(
+    dependencies: dict[str, Any],
+    target_python_version: str,
+    explainer: Explainer | None = None,
+) -> None:
+    """Remove the constraints that do not apply to the target Python version."""
+    for package, constraint in list(dependencies.items()):
+        if package == "python":
+            continue
+
+        branches = [
+            branch
+            for branch in get_branches(constraint)
+            if allows_python(branch, target_python_version)
+        ]
+        if explainer is not None:
+            for branch in get_branches(constraint):
+                if not allows_python(branch, target_python_version):
+                    explainer.write(
+                        package, get_constraint(branch), "remove", "python_excluded"
+                    )
+
+        if not branches:
+            logger.info(
+                "Removing %s as it does not apply to Python %s",
+                package,
+                target_python_version,
+            )
+            del dependencies[package]
+        elif len(branches) < len(get_branches(constraint)):
+            dependencies[package] = branches
+
+
 def min_version(constraint: str) -> Version | None:
     """Get the minimum version from a constraint."""
     c_object = parse_constraint(constraint)
@@ -29,77 +140,194 @@ async def versions_for_all(
     packages: dict[str, Any],
     target_python_version: str,
     repository: str = "https://pypi.org/pypi",
-) -> dict[str, tuple[str, str | None]]:
-    """Get the compatible version of a package for a target Python version."""
-    tasks: list[Awaitable[str | None]] = []
-    package_names: list[str] = []
-    original_constraints: list[str] = []
+    cache: MetadataCache | None = None,
+    tracer: LookupTracer | None = None,
+) -> dict[str, list[tuple[str, VersionLookup] | None]]:
+    """Get the compatible version for every constraint of every package.
+
+    The results of a package line up with its constraints; constraints without
+    a version (git, path or url dependencies) get None. If a tracer is given,
+    the lookups go through it.
+    """
+    lookup = lookup_compatible_versions if tracer is None else tracer.lookup
+    tasks: dict[str, Awaitable[list[VersionLookup]]] = {}
+    package_constraints: dict[str, list[str | None]] = {}
 
     for package, constraint in packages.items():
         if package == "python":
             continue
 
-        version_constraint = get_constraint(constraint)
+        version_constraints = [
+            get_constraint(branch) for branch in get_branches(constraint)
+        ]
+        package_constraints[package] = version_constraints
 
-        if version_constraint is None:
-            logger.warning("No version constraint found for %s", package)
+        if all(version is None for version in version_constraints):
+            logger.info("Keeping %s as it is not installed from a repository", package)
             continue
 
-        tasks.append(
-            get_compatible_versions(
-                package,
-                min_version(version_constraint),
-                target_python_version,
-                repository,
-            )
+        tasks[package] = lookup(
+            package,
+            [
+                min_version(version)
+                for version in version_constraints
+                if version is not None
+            ],
+            target_python_version,
+            repository,
+            cache,
         )
-        package_names.append(package)
-        original_constraints.append(version_constraint)
 
-    results = await asyncio.gather(*tasks, return_exceptions=False)
-    return dict(zip(package_names, zip(original_constraints, results)))
+    results = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+    return {
+        package: pair_lookups(version_constraints, results.get(package, []))
+        for package, version_constraints in package_constraints.items()
+    }
+
+
+def pair_lookups(
+    version_constraints: list[str | None], lookups: list[VersionLookup]
+) -> list[tuple[str, VersionLookup] | None]:
+    """Pair version constraints with their lookups, leaving gaps for the rest."""
+    remaining = iter(lookups)
+    return [
+        None if version is None else (version, next(remaining))
+        for version in version_constraints
+    ]
 
 
 def set_version(
-    dependencies: dict[str, str | dict[str, str]], package: str, version: str
+    dependencies: dict[str, Any],
+    package: str,
+    version: str,
+    branch: int | None = None,
 ) -> None:
-    """Set the version of a package in the dependencies."""
+    """Set the version of a package, or of one of its constraints, in the dependencies."""
     constraint = dependencies.get(package, "")
+    if branch is not None:
+        constraint = constraint[branch]
     if isinstance(constraint, str):
         dependencies[package] = version
     else:
         constraint["version"] = version
 
 
-async def downgrade_packages(
-    dependencies: dict[str, str | dict[str, str]],
-    target_python_version: str,
-    pin_version: bool = False,
-    repository: str = "https://pypi.org/pypi",
+def remove_branches(
+    dependencies: dict[str, Any], package: str, branches: list[int]
 ) -> None:
-    """Downgrade packages to be compatible with the target Python version."""
-    for package, (original_version, compatible_version) in (
-        await versions_for_all(dependencies, target_python_version, repository)
-    ).items():
-        if compatible_version is None:
-            logger.info("Removing %s as no compatible version found", package)
-            del dependencies[package]
-            continue
+    """Remove constraints of a package, and the package once none are left."""
+    constraints = get_branches(dependencies[package])
+    if len(branches) == len(constraints):
+        del dependencies[package]
+    elif branches:
+        dependencies[package] = [
+            constraint
+            for index, constraint in enumerate(constraints)
+            if index not in branches
+        ]
 
-        compatible_version = (
-            compatible_version if pin_version else f"^{compatible_version}"
-        )
 
-        if original_version == compatible_version:
-            logger.debug("Package %s is already compatible", package)
-            continue
+def compatible_constraint(
+    package: str,
+    original_version: str,
+    lookup: VersionLookup,
+    pin_version: bool,
+) -> str | None:
+    """Get the constraint to replace the original with, or None to remove it."""
+    compatible_version, reason = lookup
+    if reason is Reason.LOOKUP_FAILED:
+        logger.warning("Keeping %s as its lookup failed", package)
+        return original_version
 
+    if compatible_version is None:
+        logger.info(REMOVAL_MESSAGES[reason], package)
+        return None
+
+    compatible_version = compatible_version if pin_version else f"^{compatible_version}"
+
+    if original_version == compatible_version:
+        logger.debug("Package %s is already compatible", package)
+    else:
         logger.info(
             "Downgrading %s from %s to %s",
             package,
             original_version,
             compatible_version,
         )
-        set_version(dependencies, package, compatible_version)
+    return compatible_version
+
+
+def decision_name(original_version: str, version: str | None) -> str:
+    """Name the decision taken for a constraint, for explanations."""
+    if version is None:
+        return "remove"
+    return "keep" if version == original_version else "downgrade"
+
+
+def downgrade_package(
+    dependencies: dict[str, Any],
+    package: str,
+    lookups: list[tuple[str, VersionLookup] | None],
+    pin_version: bool,
+    explainer: Explainer | None = None,
+) -> None:
+    """Update or remove each constraint of a package according to its lookup."""
+    multiple = isinstance(dependencies[package], list)
+    removed: list[int] = []
+    traces = iter(explainer.tracer.traces.get(package, []) if explainer else [])
+
+    for index, branch in enumerate(lookups):
+        if branch is None:
+            if explainer is not None:
+                explainer.write(package, None, "keep", "not_from_repository")
+            continue
+
+        original_version, lookup = branch
+        version = compatible_constraint(package, original_version, lookup, pin_version)
+        if explainer is not None:
+            explainer.write(
+                package,
+                original_version,
+                decision_name(original_version, version),
+                lookup.reason.value,
+                next(traces, None),
+            )
+
+        if version is None:
+            removed.append(index)
+        elif version != original_version:
+            set_version(dependencies, package, version, index if multiple else None)
+
+    remove_branches(dependencies, package, removed)
+
+
+async def downgrade_packages(  # pylint: disable=too-many-arguments  # noqa: CFQ002
+    dependencies: dict[str, Any],
+    target_python_version: str,
+    pin_version: bool = False,
+    repository: str = "https://pypi.org/pypi",
+    cache: MetadataCache | None = None,
+    explain: TextIO | None = None,
+    group: str = "main",
+) -> None:
+    """Downgrade packages to be compatible with the target Python version.
+
+    If explain is given, a JSON line describing each decision is written to it,
+    naming the dependency group the packages belong to.
+    """
+    explainer = (
+        None if explain is None else Explainer(explain, target_python_version, group)
+    )
+    prune_dependencies(dependencies, target_python_version, explainer)
+
+    results = await versions_for_all(
+        dependencies,
+        target_python_version,
+        repository,
+        cache,
+        None if explainer is None else explainer.tracer,
+    )
+    for package, lookups in results.items():
+        downgrade_package(dependencies, package, lookups, pin_version, explainer)
 
     dependencies["python"] = f"^{target_python_version}"
@@ -6,7 +6,8 @@ from pathlib import Path
 
 import click
 
-from .cli import process_pyproject, write_output
+from .cli import CACHE_DIR_ENVVAR, process_pyproject, write_output
+from .pypi import MetadataCache
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
@@ -25,11 +26,18 @@ logger = logging.getLogger(__name__)
     type=str,
     default="https://pypi.org/pypi",
 )
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    envvar=CACHE_DIR_ENVVAR,
+    default=None,
+)
 def main(
     pyproject_path: Path,
     target_python_version: str,
     pin_versions: bool,
     repository: str,
+    cache_dir: Path | None,
 ) -> None:
     """Run downgrader in a Github Actions environment."""
 
@@ -46,8 +54,9 @@ def main(
         )
         return
 
+    cache = MetadataCache(cache_dir)
     updated_pyproject = process_pyproject(
-        pyproject_path, target_python_version, pin_versions, repository
+        pyproject_path, target_python_version, pin_versions, repository, cache
     )
 
     if updated_pyproject is None:
@@ -0,0 +1,122 @@
+"""Command-line interface for warming the package metadata cache."""
+
+from __future__ import annotations
+import asyncio
+import logging
+from pathlib import Path
+from typing import TextIO
+
+import click
+
+from .cli import (
+    CACHE_DIR_ENVVAR,
+    get_dependencies,
+    get_group_dependencies,
+    get_poetry_config,
+)
+from .downgrader import get_branches, get_constraint
+from .pypi import PREFETCH_CONCURRENCY, prefetch_package_info
+from .read_toml import read_toml
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+
+def get_package_names(pyproject: dict) -> set[str]:
+    """Get the names of all repository dependencies of a pyproject, across all groups.
+
+    Dependencies without a version constraint (git, path or url ones) are skipped.
+    """
+    poetry_config = get_poetry_config(pyproject)
+    return {
+        package
+        for dependencies in [get_dependencies(poetry_config)]
+        + get_group_dependencies(poetry_config)
+        for package, constraint in dependencies.items()
+        if package != "python"
+        and any(get_constraint(branch) for branch in get_branches(constraint))
+    }
+
+
+def read_package_list(package_list: TextIO) -> set[str]:
+    """Read package names from a file with one name per line."""
+    names = (line.split("#", 1)[0].strip() for line in package_list)
+    return {name for name in names if name}
+
+
+@click.command()
+@click.version_option()
+@click.argument(
+    "pyproject_paths",
+    nargs=-1,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "-p",
+    "--package",
+    "packages",
+    multiple=True,
+    help="Additional package to prefetch; can be given multiple times",
+)
+@click.option(
+    "-l",
+    "--package-list",
+    type=click.File("r"),
+    help="File listing additional packages to prefetch, one per line",
+    default=None,
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    envvar=CACHE_DIR_ENVVAR,
+    help="Directory to cache package metadata in",
+    required=True,
+)
+@click.option(
+    "-r",
+    "--repository",
+    type=str,
+    help="Custom repository URL",
+    default="https://pypi.org/pypi",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    type=click.IntRange(min=1),
+    help="Maximum number of concurrent requests",
+    default=PREFETCH_CONCURRENCY,
+    show_default=True,
+)
+def main(  # pylint: disable=too-many-arguments
+    pyproject_paths: tuple[Path, ...],
+    packages: tuple[str, ...],
+    package_list: TextIO | None,
+    cache_dir: Path,
+    repository: str,
+    concurrency: int,
+) -> None:
+    """Fill the metadata cache for the dependencies of pyproject files, without rewriting them."""
+    package_names = set(packages)
+    if package_list is not None:
+        package_names |= read_package_list(package_list)
+    for pyproject_path in pyproject_paths:
+        pyproject = read_toml(pyproject_path)
+        if pyproject is not None:
+            package_names |= get_package_names(pyproject)
+
+    if not package_names:
+        raise click.UsageError("No packages to prefetch")
+
+    stats = asyncio.run(
+        prefetch_package_info(package_names, cache_dir, repository, concurrency)
+    )
+    click.echo(
+        f"Prefetched {stats.packages} packages ({stats.failed} failed) "
+        f"in {stats.seconds:.2f}s: {stats.packages_per_second:.1f} packages/s, "
+        f"{stats.megabytes_per_second:.2f} MB/s",
+        err=True,
+    )
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -1,29 +1,346 @@
 """An interface to PyPI for fetching package information."""
 
 from __future__ import annotations
+import asyncio
+import contextlib
+from dataclasses import dataclass, field
+from enum import Enum
+import hashlib
+import json
 import logging
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import Any, Iterable, NamedTuple
 
 import aiohttp
 from poetry.core.constraints.version import Version, parse_constraint
+from poetry.core.utils.helpers import canonicalize_name
 
 logger = logging.getLogger(__name__)
 
 PYPI_URL = "https://pypi.org/pypi"
 TIMEOUT = 5
+PREFETCH_CONCURRENCY = 64
+NEGATIVE_CACHE_TTL = 60 * 60
+METADATA_CACHE_TTL = 24 * 60 * 60
 
 
-async def fetch_package_info(package: str, repository: str = PYPI_URL) -> dict | None:
-    """Fetch package information from PyPI."""
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(
-                f"{repository}/{package}/json", timeout=TIMEOUT
-            ) as response:
-                response.raise_for_status()
-                return await response.json()
-        except aiohttp.ClientError as e:
-            logger.error("Failed to fetch package info for %s: %s", package, e)
-            return None
+class Reason(str, Enum):
+    """Why a package lookup ended the way it did."""
+
+    FOUND = "found"
+    NOT_FOUND = "not_found"
+    NO_COMPATIBLE_RELEASE = "no_compatible_release"
+    LOOKUP_FAILED = "lookup_failed"
+
+
+class PackageInfo(NamedTuple):
+    """The metadata of a package, if it could be fetched."""
+
+    info: dict | None
+    reason: Reason
+
+
+class Download(NamedTuple):
+    """Package metadata as downloaded, together with the raw JSON to cache."""
+
+    info: dict | None
+    raw_info: bytes
+    reason: Reason
+
+
+class VersionLookup(NamedTuple):
+    """The highest compatible version of a package, if there is one."""
+
+    version: str | None
+    reason: Reason
+
+
+# On-disk metadata cache
+def cache_path(cache_dir: Path, package: str, repository: str = PYPI_URL) -> Path:
+    """Get the path the metadata of a package is cached at."""
+    repository_key = hashlib.sha256(repository.encode()).hexdigest()[:16]
+    return cache_dir / repository_key / f"{canonicalize_name(package)}.json"
+
+
+def negative_cache_path(
+    cache_dir: Path, package: str, repository: str = PYPI_URL
+) -> Path:
+    """Get the path a negative lookup result of a package is cached at."""
+    path = cache_path(cache_dir, package, repository)
+    return path.parent / "negative" / path.name
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    """Write a file so that concurrent readers never see a partial write.
+
+    Failing to write is logged and otherwise ignored, as the cache is optional.
+    """
+    tmp_path = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Failed to write cache entry %s: %s", path, e)
+        if tmp_path is not None:
+            with contextlib.suppress(OSError):
+                Path(tmp_path).unlink(missing_ok=True)
+
+
+def entry_age(path: Path) -> float:
+    """Get the age of a cache entry in seconds, or infinity if it cannot be read."""
+    try:
+        return time.time() - path.stat().st_mtime
+    except OSError:
+        return float("inf")
+
+
+def read_fresh(path: Path, ttl: float) -> bytes | None:
+    """Read a cache entry, unless it is older than ttl seconds."""
+    with contextlib.suppress(OSError):
+        if time.time() - path.stat().st_mtime <= ttl:
+            return path.read_bytes()
+    return None
+
+
+def parse_package_info(raw_info: bytes) -> dict | None:
+    """Parse package information JSON, or get None if it is not package metadata."""
+    try:
+        info = json.loads(raw_info)
+    except ValueError:
+        return None
+    if isinstance(info, dict) and isinstance(info.get("releases"), dict):
+        return info
+    return None
+
+
+def read_cached_info(
+    cache_dir: Path,
+    package: str,
+    repository: str = PYPI_URL,
+    ttl: float = METADATA_CACHE_TTL,
+) -> dict | None:
+    """Read cached package information, unless there is none or it has expired."""
+    raw_info = read_fresh(cache_path(cache_dir, package, repository), ttl)
+    return None if raw_info is None else parse_package_info(raw_info)
+
+
+def write_cached_info(
+    cache_dir: Path, package: str, raw_info: bytes, repository: str = PYPI_URL
+) -> None:
+    """Cache raw package information, dropping any negative entry."""
+    write_atomically(cache_path(cache_dir, package, repository), raw_info)
+    negative_path = negative_cache_path(cache_dir, package, repository)
+    try:
+        negative_path.unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning("Failed to remove cache entry %s: %s", negative_path, e)
+
+
+def read_cached_reason(
+    cache_dir: Path,
+    package: str,
+    repository: str = PYPI_URL,
+    ttl: float = NEGATIVE_CACHE_TTL,
+) -> Reason | None:
+    """Read a cached negative lookup result, unless it has expired."""
+    raw_reason = read_fresh(negative_cache_path(cache_dir, package, repository), ttl)
+    if raw_reason is None:
+        return None
+    try:
+        return Reason(raw_reason.decode().strip())
+    except ValueError:
+        return None
+
+
+def write_cached_reason(
+    cache_dir: Path, package: str, reason: Reason, repository: str = PYPI_URL
+) -> None:
+    """Cache a negative lookup result."""
+    write_atomically(
+        negative_cache_path(cache_dir, package, repository), reason.value.encode()
+    )
+
+
+# Fetching
+async def download_package_info(
+    session: aiohttp.ClientSession, package: str, repository: str = PYPI_URL
+) -> Download:
+    """Download and parse the package information JSON from PyPI."""
+    try:
+        async with session.get(
+            f"{repository}/{package}/json", timeout=TIMEOUT
+        ) as response:
+            if response.status in (404, 410):
+                logger.error("Package %s not found in %s", package, repository)
+                return Download(None, b"", Reason.NOT_FOUND)
+            response.raise_for_status()
+            raw_info = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("Failed to fetch package info for %s: %r", package, e)
+        return Download(None, b"", Reason.LOOKUP_FAILED)
+
+    info = parse_package_info(raw_info)
+    if info is None:
+        logger.error("Got invalid package info for %s from %s", package, repository)
+        raw_info = b""
+    return Download(
+        info, raw_info, Reason.LOOKUP_FAILED if info is None else Reason.FOUND
+    )
+
+
+@dataclass
+class MetadataCache:
+    """Package metadata, cached on disk if a directory is given and for the run.
+
+    Metadata is cached on disk for metadata_ttl seconds. Negative results (the
+    package does not exist) are cached on disk for negative_ttl seconds; failed
+    lookups are only remembered for the run, so that every group does not wait
+    out the timeout again. "No compatible release" is a negative result too:
+    cached metadata is only trusted for it as long as a cached negative result
+    would be, and then fetched again (see needs_refetch).
+    """
+
+    cache_dir: Path | None = None
+    use_negative_cache: bool = True
+    negative_ttl: float = NEGATIVE_CACHE_TTL
+    metadata_ttl: float = METADATA_CACHE_TTL
+    lookups: dict[tuple[str, str], asyncio.Future[PackageInfo]] = field(
+        default_factory=dict, repr=False
+    )
+    cached_ages: dict[tuple[str, str], float] = field(default_factory=dict, repr=False)
+
+    def is_fetched(self, package: str, repository: str = PYPI_URL) -> bool:
+        """Tell if the package information was already requested in this run."""
+        return (repository, canonicalize_name(package)) in self.lookups
+
+    async def fetch(self, package: str, repository: str = PYPI_URL) -> PackageInfo:
+        """Fetch package information, fetching each package only once per run."""
+        key = (repository, canonicalize_name(package))
+        if key not in self.lookups:
+            self.lookups[key] = asyncio.ensure_future(
+                self.fetch_uncached(package, repository)
+            )
+        return await self.lookups[key]
+
+    async def fetch_uncached(self, package: str, repository: str) -> PackageInfo:
+        """Fetch package information from the disk cache or the repository."""
+        if self.cache_dir is not None:
+            cached = read_cached_info(
+                self.cache_dir, package, repository, self.metadata_ttl
+            )
+            if cached is not None:
+                self.cached_ages[(repository, canonicalize_name(package))] = entry_age(
+                    cache_path(self.cache_dir, package, repository)
+                )
+                return PackageInfo(cached, Reason.FOUND)
+            if self.use_negative_cache:
+                reason = read_cached_reason(
+                    self.cache_dir, package, repository, self.negative_ttl
+                )
+                if reason is not None:
+                    logger.debug("Using cached %s for %s", reason.value, package)
+                    return PackageInfo(None, reason)
+        return await self.download(package, repository)
+
+    async def download(self, package: str, repository: str) -> PackageInfo:
+        """Download package information from the repository, caching it on disk."""
+        async with aiohttp.ClientSession() as session:
+            info, raw_info, reason = await download_package_info(
+                session, package, repository
+            )
+
+        if self.cache_dir is not None:
+            if info is not None:
+                write_cached_info(self.cache_dir, package, raw_info, repository)
+            elif reason is Reason.NOT_FOUND:
+                write_cached_reason(self.cache_dir, package, reason, repository)
+        return PackageInfo(info, reason)
+
+    def needs_refetch(
+        self, package: str, repository: str, lookups: list[VersionLookup]
+    ) -> bool:
+        """Tell if lookups found no compatible release in metadata too old to trust."""
+        age = self.cached_ages.get((repository, canonicalize_name(package)))
+        return (
+            age is not None
+            and (not self.use_negative_cache or age > self.negative_ttl)
+            and any(lookup.reason is Reason.NO_COMPATIBLE_RELEASE for lookup in lookups)
+        )
+
+    async def refetch(self, package: str, repository: str = PYPI_URL) -> PackageInfo:
+        """Download package information again, once per run, bypassing the disk cache."""
+        key = (repository, canonicalize_name(package))
+        if self.cached_ages.pop(key, None) is not None:
+            self.lookups[key] = asyncio.ensure_future(
+                self.download(package, repository)
+            )
+        return await self.fetch(package, repository)
+
+
+async def fetch_package_info(
+    package: str, repository: str = PYPI_URL, cache: MetadataCache | None = None
+) -> PackageInfo:
+    """Fetch package information from PyPI, going through the cache if given."""
+    return await (cache or MetadataCache()).fetch(package, repository)
+
+
+@dataclass
+class PrefetchStats:
+    """Throughput of a metadata prefetch."""
+
+    packages: int = 0
+    failed: int = 0
+    downloaded_bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def packages_per_second(self) -> float:
+        """Packages fetched per second."""
+        return self.packages / self.seconds if self.seconds else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        """Megabytes downloaded per second."""
+        return self.downloaded_bytes / 1e6 / self.seconds if self.seconds else 0.0
+
+
+async def prefetch_package_info(
+    packages: Iterable[str],
+    cache_dir: Path,
+    repository: str = PYPI_URL,
+    concurrency: int = PREFETCH_CONCURRENCY,
+) -> PrefetchStats:
+    """Download and cache the metadata of many packages concurrently."""
+    names = sorted({canonicalize_name(package) for package in packages})
+    stats = PrefetchStats()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def prefetch(session: aiohttp.ClientSession, package: str) -> None:
+        async with semaphore:
+            info, raw_info, reason = await download_package_info(
+                session, package, repository
+            )
+        if info is None:
+            stats.failed += 1
+            if reason is Reason.NOT_FOUND:
+                write_cached_reason(cache_dir, package, reason, repository)
+            return
+        write_cached_info(cache_dir, package, raw_info, repository)
+        stats.packages += 1
+        stats.downloaded_bytes += len(raw_info)
+
+    start = time.perf_counter()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(prefetch(session, package) for package in names))
+    stats.seconds = time.perf_counter() - start
+    return stats
 
 
 def is_version_compatible(release_info: list[dict], target_python_version: str) -> bool:
@@ -67,18 +384,182 @@ def get_highest_version(versions: list[str]) -> str | None:
     return max(versions, key=parse_version)
 
 
+def get_requires_python(release_info: list[dict]) -> str | None:
+    """Get the Python requirements declared by the files of a release."""
+    requirements = sorted(
+        {
+            info["requires_python"]
+            for info in release_info
+            if info.get("requires_python")
+        }
+    )
+    return ", ".join(requirements) or None
+
+
+def empty_trace() -> dict[str, Any]:
+    """Describe a decision that did not involve a lookup."""
+    return {
+        "candidates": [],
+        "first_rejected": None,
+        "selected": None,
+        "fetch_seconds": 0.0,
+        "fetch_shared": False,
+        "evaluate_seconds": 0.0,
+    }
+
+
+def explain_lookup(
+    releases: dict[str, list[dict]],
+    max_version: Version | None,
+    version: str | None,
+    target_python_version: str,
+) -> dict[str, Any]:
+    """Describe the candidates considered, newest first, down to the selected one."""
+    candidates = sorted(
+        filter_max_version(list(releases), max_version), key=parse_version, reverse=True
+    )
+    if version is not None:
+        candidates = candidates[: candidates.index(version) + 1]
+    first_rejected = next(
+        (
+            {
+                "version": candidate,
+                "requires_python": get_requires_python(releases[candidate]),
+            }
+            for candidate in candidates
+            if not is_version_compatible(releases[candidate], target_python_version)
+        ),
+        None,
+    )
+    return {
+        "candidates": candidates,
+        "first_rejected": first_rejected,
+        "selected": version,
+    }
+
+
+def select_compatible_versions(
+    package_info: PackageInfo,
+    max_versions: list[Version | None],
+    target_python_version: str,
+) -> list[VersionLookup]:
+    """Select the highest compatible version of a package under each max version."""
+    if package_info.info is None:
+        return [VersionLookup(None, package_info.reason) for _ in max_versions]
+
+    compatible_versions = filter_compatible_versions(
+        package_info.info["releases"], target_python_version
+    )
+    lookups = []
+    for max_version in max_versions:
+        version = get_highest_version(
+            filter_max_version(compatible_versions, max_version)
+        )
+        reason = Reason.NO_COMPATIBLE_RELEASE if version is None else Reason.FOUND
+        lookups.append(VersionLookup(version, reason))
+    return lookups
+
+
+async def lookup_compatible_versions(
+    package: str,
+    max_versions: list[Version | None],
+    target_python_version: str,
+    repository: str = PYPI_URL,
+    cache: MetadataCache | None = None,
+) -> list[VersionLookup]:
+    """Find the highest compatible version of a package under each max version.
+
+    The metadata is fetched and filtered for the target Python version once,
+    however many max versions there are.
+    """
+    cache = cache or MetadataCache()
+    package_info = await fetch_package_info(package, repository, cache)
+    lookups = select_compatible_versions(
+        package_info, max_versions, target_python_version
+    )
+    if not cache.needs_refetch(package, repository, lookups):
+        return lookups
+    package_info = await cache.refetch(package, repository)
+    return select_compatible_versions(package_info, max_versions, target_python_version)
+
+
+@dataclass
+class LookupTracer:
+    """Looks up compatible versions, keeping a trace of every lookup.
+
+    Each lookup stores one trace per max version under the package name. The
+    time spent fetching and evaluating a package is counted in its first trace
+    only, so that the times of all traces add up. The other traces, and those
+    of lookups reusing metadata another lookup fetched, have fetch_shared set.
+    """
+
+    traces: dict[str, list[dict[str, Any]]] = field(default_factory=dict)
+
+    async def lookup(  # pylint: disable=too-many-arguments
+        self,
+        package: str,
+        max_versions: list[Version | None],
+        target_python_version: str,
+        repository: str = PYPI_URL,
+        cache: MetadataCache | None = None,
+    ) -> list[VersionLookup]:
+        """Find compatible versions as lookup_compatible_versions does, tracing it."""
+        cache = cache or MetadataCache()
+        shared = cache.is_fetched(package, repository)
+        start = time.perf_counter()
+        package_info = await fetch_package_info(package, repository, cache)
+        fetched = time.perf_counter()
+        lookups = select_compatible_versions(
+            package_info, max_versions, target_python_version
+        )
+        if cache.needs_refetch(package, repository, lookups):
+            refetch_start = time.perf_counter()
+            package_info = await cache.refetch(package, repository)
+            fetched += time.perf_counter() - refetch_start
+            lookups = select_compatible_versions(
+                package_info, max_versions, target_python_version
+            )
+        evaluated = time.perf_counter()
+
+        releases = {} if package_info.info is None else package_info.info["releases"]
+        self.traces[package] = [
+            {
+                **explain_lookup(
+                    releases, max_version, lookup.version, target_python_version
+                ),
+                "fetch_seconds": 0.0 if shared or index else fetched - start,
+                "fetch_shared": shared or index > 0,
+                "evaluate_seconds": 0.0 if index else evaluated - fetched,
+            }
+            for index, (max_version, lookup) in enumerate(zip(max_versions, lookups))
+        ]
+        return lookups
+
+
+async def lookup_compatible_version(
+    package: str,
+    max_version: Version | None,
+    target_python_version: str,
+    repository: str = PYPI_URL,
+    cache: MetadataCache | None = None,
+) -> VersionLookup:
+    """Find the highest compatible version of a package, and why there is none."""
+    (lookup,) = await lookup_compatible_versions(
+        package, [max_version], target_python_version, repository, cache
+    )
+    return lookup
+
+
 async def get_compatible_versions(
     package: str,
     max_version: Version | None,
     target_python_version: str,
     repository: str = PYPI_URL,
+    cache: MetadataCache | None = None,
 ) -> str | None:
     """Find the highest compatible version of a package for the target Python version."""
-    package_info = await fetch_package_info(package, repository)
-    if not package_info:
-        return None
-
-    releases = package_info["releases"]
-    compatible_versions = filter_compatible_versions(releases, target_python_version)
-    filtered_versions = filter_max_version(compatible_versions, max_version)
-    return get_highest_version(filtered_versions)
+    return (
+        await lookup_compatible_version(
+            package, max_version, target_python_version, repository, cache
+        )
+    ).version
@@ -1,20 +1,51 @@
 """Reads a pyproject.toml file."""
 
 from __future__ import annotations
+import copy
+from dataclasses import dataclass, field
+import sys
 from typing import Any, TYPE_CHECKING
 
 import click
-import toml
+
+# tomllib is much faster than the pure-Python toml package, but only ships with 3.11+
+if sys.version_info >= (3, 11):
+    from tomllib import TOMLDecodeError as TomlDecodeError, loads as loads_toml
+else:  # pragma: no cover
+    from toml import TomlDecodeError, loads as loads_toml
 
 if TYPE_CHECKING:
     from pathlib import Path
 
 
-def read_toml(path: Path) -> dict[str, Any] | None:
-    """Read a TOML file."""
+@dataclass
+class TomlSource:
+    """A TOML file as read, with a copy of its contents to update.
+
+    The text and what it parsed to are kept, so that writing the updated
+    document back does not need to read or parse the file again.
+    """
+
+    text: str
+    original: dict[str, Any]
+    document: dict[str, Any] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.document = copy.deepcopy(self.original)
+
+
+def read_toml_source(path: Path) -> TomlSource | None:
+    """Read a TOML file, keeping its text with its line endings as they are."""
+    with path.open(encoding="utf-8", newline="") as f:
+        text = f.read()
     try:
-        with path.open() as f:
-            return toml.load(f)
-    except toml.TomlDecodeError:
+        return TomlSource(text, loads_toml(text))
+    except TomlDecodeError:
         click.echo(f"Failed to parse {path}. Ensure it's a valid TOML file.", err=True)
         return None
+
+
+def read_toml(path: Path) -> dict[str, Any] | None:
+    """Read a TOML file."""
+    source = read_toml_source(path)
+    return None if source is None else source.original
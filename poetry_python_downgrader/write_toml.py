@@ -0,0 +1,627 @@
+"""Writes a pyproject.toml file, rewriting only the values that changed."""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+import json
+import re
+from typing import Any
+
+import toml
+
+from .read_toml import loads_toml
+
+BARE_KEY = re.compile(r"[A-Za-z0-9_-]+")
+SIMPLE_KEY = re.compile(r"([A-Za-z0-9_-]+)[ \t]*=[ \t]*")
+BLANK = re.compile(r"(?:[ \t\r\n]+|#[^\n]*)*")
+SPACES = re.compile(r"[ \t]*")
+PLAIN = re.compile(r"[^\"'#\[\]{}\n]+")
+SIMPLE_VALUE = re.compile(
+    r"""("(?:[^"\\\n]|\\.)*"(?!")|'[^'\n]*'(?!')|[^\s#\[{"']+)[ \t]*(?=#|\r?\n|$)"""
+)
+ONE_LINE_VALUE = re.compile(
+    r"""([\[{](?:"(?:[^"\\\n]|\\.)*"|'[^'\n]*'|[^"'#\n])*?[\]}])[ \t]*(?=#|\r?\n|$)"""
+)
+FLAT_ARRAY = re.compile(
+    r"""\[(?:\s|#[^\n]*|"(?:[^"\\\n]|\\.)*"|'[^'\n]*'|[^\s\[\]{}"'#]"""
+    r"""|\{(?:"(?:[^"\\\n]|\\.)*"|'[^'\n]*'|[^"'{}\[\]\n])*\})*\]"""
+)
+ONE_LINE_STRING = re.compile(r"""("(?:[^"\\\n]|\\.)*"|'[^'\n]*')""")
+STRINGS = (
+    re.compile(r'"""(?:[^"\\]|\\[\s\S]|"(?!""))*"""(?:""|")?'),
+    re.compile(r"'''(?:[^']|'(?!''))*'''(?:''|')?"),
+    re.compile(r'"(?:[^"\\\n]|\\.)*"'),
+    re.compile(r"'[^'\n]*'"),
+)
+INLINE_VERSION = re.compile(
+    r"""(?:^\{|,)\s*version\s*=\s*("(?:[^"\\\n]|\\.)*"|'[^'\n]*')"""
+)
+
+_MISSING = object()
+_OPAQUE = object()
+
+
+class ScanError(ValueError):
+    """The original text could not be scanned."""
+
+    def __init__(self, pos: int) -> None:
+        super().__init__(pos)
+        self.pos = pos
+
+    def __str__(self) -> str:
+        return f"Cannot scan TOML at position {self.pos}"
+
+
+class RenderError(ValueError):
+    """A value has no inline TOML representation."""
+
+    def __init__(self, value: Any) -> None:
+        super().__init__(value)
+        self.value = value
+
+    def __str__(self) -> str:
+        return f"Cannot render {self.value!r} as TOML"
+
+
+@dataclass
+class Entry:
+    """A `key = value` line of the original document."""
+
+    path: tuple[str, ...]
+    start: int
+    value_start: int
+    value_end: int
+    end: int
+
+
+@dataclass
+class Section:
+    """A `[table]` or `[[array]]` header together with its entries."""
+
+    path: tuple[str, ...]
+    start: int
+    insert_at: int
+    array: bool = False
+    entries: list[Entry] = field(default_factory=list)
+
+
+# Scanning
+def skip_spaces(text: str, pos: int) -> int:
+    """Skip spaces and tabs, but not newlines."""
+    return SPACES.match(text, pos).end()  # type: ignore[union-attr]
+
+
+def line_end(text: str, pos: int) -> int:
+    """Get the position right after the newline ending the current line."""
+    newline = text.find("\n", pos)
+    return len(text) if newline == -1 else newline + 1
+
+
+def skip_string(text: str, pos: int) -> int:
+    """Get the position right after the string literal starting at pos."""
+    for pattern in STRINGS:
+        match = pattern.match(text, pos)
+        if match is not None:
+            return match.end()
+    raise ScanError(pos)
+
+
+def parse_key(text: str, pos: int) -> tuple[tuple[str, ...], int]:
+    """Parse a (possibly dotted or quoted) key, returning it and its end."""
+    parts: list[str] = []
+    while True:
+        pos = skip_spaces(text, pos)
+        if text[pos] in "\"'":
+            end = skip_string(text, pos)
+            parts.append(loads_toml(f"key = {text[pos:end]}")["key"])
+            pos = end
+        else:
+            match = BARE_KEY.match(text, pos)
+            if match is None:
+                raise ScanError(pos)
+            parts.append(match.group())
+            pos = match.end()
+        pos = skip_spaces(text, pos)
+        if not text.startswith(".", pos):
+            return tuple(parts), pos
+        pos += 1
+
+
+def is_balanced(value_text: str) -> bool:
+    """Check if the brackets of a value on a single line all close on it."""
+    if value_text[0] not in "[{":
+        return True
+    brackets = ONE_LINE_STRING.sub("", value_text)
+    opened = brackets.count("[") + brackets.count("{")
+    return opened == brackets.count("]") + brackets.count("}")
+
+
+def skip_value(text: str, pos: int) -> int:
+    """Get the end of the value starting at pos, excluding trailing comments."""
+    simple = SIMPLE_VALUE.match(text, pos) or ONE_LINE_VALUE.match(text, pos)
+    if simple is not None and is_balanced(simple.group(1)):
+        return simple.end(1)
+    array = FLAT_ARRAY.match(text, pos)
+    if array is not None:
+        return array.end()
+
+    depth = 0
+    end = pos
+    while pos < len(text):
+        plain = PLAIN.match(text, pos)
+        if plain is not None:
+            if not plain.group().isspace():
+                end = pos + len(plain.group().rstrip())
+            pos = plain.end()
+            continue
+        char = text[pos]
+        if char in "\"'":
+            pos = end = skip_string(text, pos)
+            continue
+        if char in "#\n" and depth == 0:
+            break
+        if char == "#":
+            pos = line_end(text, pos)
+            continue
+        if char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+        if char != "\n":
+            end = pos + 1
+        pos += 1
+    return end
+
+
+def skip_item(text: str, pos: int) -> int:
+    """Get the end of the array item starting at pos, excluding its comma."""
+    depth = 0
+    end = pos
+    while True:
+        char = text[pos]
+        if char in "\"'":
+            pos = end = skip_string(text, pos)
+            continue
+        if char == "#":
+            pos = line_end(text, pos)
+            continue
+        if depth == 0 and char in ",]":
+            return end
+        if char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+        if not char.isspace():
+            end = pos + 1
+        pos += 1
+
+
+def array_items(text: str, start: int, end: int) -> list[tuple[int, int]]:
+    """Locate the items of the array spanning text[start:end]."""
+    items: list[tuple[int, int]] = []
+    pos = start + 1
+    while True:
+        pos = BLANK.match(text, pos).end()  # type: ignore[union-attr]
+        if pos == end - 1:
+            return items
+        item_end = skip_item(text, pos)
+        if item_end == pos:
+            raise ScanError(pos)
+        items.append((pos, item_end))
+        pos = BLANK.match(text, item_end).end()  # type: ignore[union-attr]
+        if text[pos] == ",":
+            pos += 1
+        elif pos != end - 1:
+            raise ScanError(pos)
+
+
+def scan_document(text: str) -> list[Section]:
+    """Locate every table header and key/value pair in a TOML document."""
+    sections = [Section(path=(), start=0, insert_at=0)]
+    pos = BLANK.match(text).end()  # type: ignore[union-attr]
+    while pos < len(text):
+        start = text.rfind("\n", 0, pos) + 1
+        if text[pos] == "[":
+            array = text.startswith("[[", pos)
+            path, pos = parse_key(text, pos + (2 if array else 1))
+            closing = "]]" if array else "]"
+            if not text.startswith(closing, pos):
+                raise ScanError(start)
+            pos = line_end(text, pos + len(closing))
+            sections.append(Section(path, start, insert_at=pos, array=array))
+            pos = BLANK.match(text, pos).end()  # type: ignore[union-attr]
+            continue
+
+        simple = SIMPLE_KEY.match(text, pos)
+        if simple is not None:
+            path, value_start = (simple.group(1),), simple.end()
+        else:
+            path, pos = parse_key(text, pos)
+            if not text.startswith("=", pos):
+                raise ScanError(pos)
+            value_start = skip_spaces(text, pos + 1)
+        value_end = skip_value(text, value_start)
+        pos = line_end(text, value_end)
+        sections[-1].entries.append(Entry(path, start, value_start, value_end, pos))
+        sections[-1].insert_at = pos
+        pos = BLANK.match(text, pos).end()  # type: ignore[union-attr]
+
+    return sections
+
+
+# Rendering
+def render_key(key: str) -> str:
+    """Render a key, quoting it if it is not a valid bare key."""
+    return key if BARE_KEY.fullmatch(key) else json.dumps(key, ensure_ascii=False)
+
+
+def render_scalar(value: Any) -> str:
+    """Render a string, boolean, number or date as TOML."""
+    if isinstance(value, (bool, str)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise RenderError(value)
+
+
+def render_value(value: Any) -> str:
+    """Render a value as inline TOML."""
+    if isinstance(value, list):
+        return f"[{', '.join(render_value(item) for item in value)}]"
+    if isinstance(value, dict):
+        items = ", ".join(
+            f"{render_key(k)} = {render_value(v)}" for k, v in value.items()
+        )
+        return f"{{ {items} }}" if items else "{}"
+    return render_scalar(value)
+
+
+def render_replacement(original_text: str, value: Any) -> str:
+    """Render a value, keeping the quoting style of the text it replaces."""
+    if (
+        isinstance(value, str)
+        and original_text.startswith("'")
+        and not original_text.startswith("'''")
+        and "'" not in value
+        and "\n" not in value
+    ):
+        return f"'{value}'"
+    return render_value(value)
+
+
+def version_span(value_text: str, old: Any, new: Any) -> tuple[int, int] | None:
+    """Locate the version of an inline table if it is the only thing that changed."""
+    if not (
+        isinstance(old, dict)
+        and isinstance(new, dict)
+        and old.keys() == new.keys()
+        and value_text.startswith("{")
+        and value_text.endswith("}")
+        and {k: v for k, v in old.items() if k != "version"}
+        == {k: v for k, v in new.items() if k != "version"}
+    ):
+        return None
+    matches = list(INLINE_VERSION.finditer(value_text))
+    return matches[0].span(1) if len(matches) == 1 else None
+
+
+# Patching
+def lookup(document: Any, path: tuple[str, ...]) -> Any:
+    """Get the value at path, or a marker if it is missing or not addressable."""
+    for key in path:
+        if not isinstance(document, dict):
+            return _OPAQUE
+        if key not in document:
+            return _MISSING
+        document = document[key]
+    return document
+
+
+def mark_seen(seen: dict[tuple[str, ...], set[str]], path: tuple[str, ...]) -> None:
+    """Record that every prefix of path is defined in the original text."""
+    for i, key in enumerate(path):
+        seen.setdefault(path[:i], set()).add(key)
+
+
+def is_plain_string(value_text: str) -> bool:
+    """Check if a value is a one-line string without escapes or inner quotes."""
+    quote = value_text[:1]
+    return (
+        quote in ("'", '"')
+        and len(value_text) > 1
+        and value_text[-1] == quote
+        and quote not in value_text[1:-1]
+        and "\\" not in value_text
+        and "\n" not in value_text
+    )
+
+
+def check_values(checks: list[tuple[int, str, Any]]) -> None:
+    """Check that the text of each value about to be edited is the original value.
+
+    Plain strings are compared directly; the other values are parsed together.
+    """
+    pending = []
+    for pos, value_text, old in checks:
+        if not is_plain_string(value_text):
+            pending.append((pos, value_text, old))
+        elif value_text[1:-1] != old:
+            raise ScanError(pos)
+
+    parsed = loads_toml(
+        "".join(
+            f"v{i} = {value_text}\n" for i, (_, value_text, _) in enumerate(pending)
+        )
+    )
+    for i, (pos, _, old) in enumerate(pending):
+        if parsed.get(f"v{i}", _MISSING) != old:
+            raise ScanError(pos)
+    if len(parsed) != len(pending):
+        raise ScanError(0)
+
+
+def check_removal(section: Section, text: str, original: dict[str, Any]) -> None:
+    """Check that the text of a section to remove defines what the original has."""
+    parsed = lookup(loads_toml(text[section.start : section.insert_at]), section.path)
+    table = lookup(original, section.path)
+    if section.array:
+        matches = isinstance(parsed, list) and isinstance(table, list)
+        matches = matches and parsed[0] in table
+    else:
+        matches = isinstance(parsed, dict) and isinstance(table, dict)
+        matches = matches and all(
+            table.get(k, _MISSING) == v for k, v in parsed.items()
+        )
+    if not matches:
+        raise ScanError(section.start)
+
+
+def value_edit(
+    text: str, start: int, end: int, old: Any, new: Any
+) -> tuple[tuple[int, int, str], tuple[int, str, Any]]:
+    """Get the edit replacing a value, and the check of the text it replaces.
+
+    Only the version is rewritten if nothing else of an inline table changed.
+    """
+    span = version_span(text[start:end], old, new)
+    if span is None:
+        return (start, end, render_replacement(text[start:end], new)), (
+            start,
+            text[start:end],
+            old,
+        )
+    start, end = (start + offset for offset in span)
+    return (start, end, render_replacement(text[start:end], new["version"])), (
+        start,
+        text[start:end],
+        old["version"],
+    )
+
+
+def same_but_version(old: Any, new: Any) -> bool:
+    """Check if two constraints differ in their version at most."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        return {k: v for k, v in old.items() if k != "version"} == {
+            k: v for k, v in new.items() if k != "version"
+        }
+    return old == new
+
+
+def item_removal(
+    text: str, items: list[tuple[int, int]], index: int
+) -> tuple[int, int]:
+    """Get the span to delete to remove an array item along with its comma.
+
+    An item on lines of its own is removed with those lines, keeping the
+    comments above it, as entries are.
+    """
+    start, end = items[index]
+    after = skip_spaces(text, end)
+    if text.startswith(",", after):
+        after = skip_spaces(text, after + 1)
+    line_start = text.rfind("\n", 0, start) + 1
+    if not text[line_start:start].strip() and text[after] in "#\r\n":
+        return (line_start, line_end(text, after))
+    return (start, after)
+
+
+def array_edits(
+    entry: Entry,
+    text: str,
+    old: list[Any],
+    new: list[Any],
+    checks: list[tuple[int, str, Any]],
+) -> list[tuple[int, int, str]] | None:
+    """Get the edits updating the items of an array in place.
+
+    This works if the new array is the old one with some items removed and the
+    version of others changed, as when branches of a multiple constraints
+    dependency are downgraded or dropped; None is returned otherwise.
+    """
+    items = array_items(text, entry.value_start, entry.value_end)
+    if len(items) != len(old):
+        raise ScanError(entry.value_start)
+    kept: dict[int, Any] = {}
+    for index, item in enumerate(old):
+        if len(kept) < len(new) and same_but_version(item, new[len(kept)]):
+            kept[index] = new[len(kept)]
+    if not kept or len(kept) != len(new):
+        return None
+
+    edits = []
+    for index, (start, end) in enumerate(items):
+        checks.append((start, text[start:end], old[index]))
+        if index not in kept:
+            edits.append(item_removal(text, items, index) + ("",))
+        elif kept[index] != old[index]:
+            edit, check = value_edit(text, start, end, old[index], kept[index])
+            edits.append(edit)
+            checks.append(check)
+
+    last = max(kept)
+    end = item_removal(text, items, len(items) - 1)[1]
+    if last < len(items) - 1 and text[end - 1] != "\n":
+        # The array closes on the line of its last item, so remove the
+        # separator after the last kept item along with the items after it
+        edits = [edit for edit in edits if edit[0] < items[last][1]]
+        edits.append((items[last][1], end, ""))
+    return edits
+
+
+def entry_edits(
+    entry: Entry,
+    text: str,
+    old: Any,
+    new: Any,
+    checks: list[tuple[int, str, Any]],
+) -> list[tuple[int, int, str]]:
+    """Get the edits updating or removing an entry, adding the text they replace to checks."""
+    value_text = text[entry.value_start : entry.value_end]
+    if new is _MISSING:
+        checks.append((entry.value_start, value_text, old))
+        return [(entry.start, entry.end, "")]
+
+    if isinstance(old, list) and isinstance(new, list) and value_text[:1] == "[":
+        edits = array_edits(entry, text, old, new, checks)
+        if edits is not None:
+            return edits
+
+    edit, check = value_edit(text, entry.value_start, entry.value_end, old, new)
+    checks.append(check)
+    return [edit]
+
+
+def section_edits(
+    section: Section,
+    text: str,
+    original: dict[str, Any],
+    document: dict[str, Any],
+    checks: list[tuple[int, str, Any]],
+) -> list[tuple[int, int, str]]:
+    """Get the edits needed to bring a section in line with the document.
+
+    The text of every value that is replaced or removed is added to checks, to
+    be compared with the original, so a scanning mistake cannot edit the wrong
+    span.
+    """
+    table = lookup(document, section.path)
+    if table is _MISSING:
+        check_removal(section, text, original)
+        # Comments and blank lines before the next header belong to that header
+        return [(section.start, section.insert_at, "")]
+    if section.array or table is _OPAQUE:
+        if table != lookup(original, section.path):
+            raise ScanError(section.start)
+        return []
+
+    edits = []
+    for entry in section.entries:
+        path = section.path + entry.path
+        new = lookup(document, path)
+        old = lookup(original, path)
+        if new == old:
+            continue
+        if new is _OPAQUE or old is _MISSING or old is _OPAQUE:
+            raise ScanError(entry.value_start)
+        edits.extend(entry_edits(entry, text, old, new, checks))
+    return edits
+
+
+def defined_keys(
+    sections: list[Section],
+) -> tuple[dict[tuple[str, ...], set[str]], dict[tuple[str, ...], Section]]:
+    """Get the keys the text defines in each table, and the header of each table."""
+    seen: dict[tuple[str, ...], set[str]] = {}
+    headers: dict[tuple[str, ...], Section] = {}
+    for section in sections:
+        mark_seen(seen, section.path)
+        for entry in section.entries:
+            mark_seen(seen, section.path + entry.path)
+        if not section.array:
+            seen.setdefault(section.path, set())
+            headers[section.path] = section
+    return seen, headers
+
+
+def insertion_edits(
+    sections: list[Section],
+    text: str,
+    original: dict[str, Any],
+    document: dict[str, Any],
+) -> list[tuple[int, int, str]]:
+    """Get the edits adding keys that are absent from the original text.
+
+    Every key of the original must have been found in the text, and keys can
+    only be added to tables that have a header.
+    """
+    seen, headers = defined_keys(sections)
+    newline = "\r\n" if "\r\n" in text else "\n"
+    edits = []
+    for path, keys in seen.items():
+        old_table = lookup(original, path)
+        table = lookup(document, path)
+        if isinstance(old_table, dict) and not old_table.keys() <= keys:
+            raise ScanError(0)
+        if not isinstance(table, dict) or table.keys() <= keys:
+            continue
+        if path not in headers:
+            raise ScanError(0)
+        lines = "".join(
+            f"{render_key(key)} = {render_value(value)}{newline}"
+            for key, value in table.items()
+            if key not in keys
+        )
+        insert_at = headers[path].insert_at
+        if insert_at and text[insert_at - 1] != "\n":
+            lines = f"{newline}{lines}"
+        edits.append((insert_at, insert_at, lines))
+    return edits
+
+
+def patch_toml(
+    text: str, document: dict[str, Any], original: dict[str, Any] | None = None
+) -> str | None:
+    """Rewrite only the spans of text that differ from the document.
+
+    original is what the text parses to; it is parsed here if not given.
+    """
+    if original is None:
+        original = loads_toml(text)
+    sections = scan_document(text)
+
+    checks: list[tuple[int, str, Any]] = []
+    edits = insertion_edits(sections, text, original, document)
+    for section in sections:
+        edits.extend(section_edits(section, text, original, document, checks))
+    check_values(checks)
+
+    pieces: list[str] = []
+    last = 0
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[:2]):
+        if start < last:
+            return None
+        pieces.extend((text[last:start], replacement))
+        last = end
+    pieces.append(text[last:])
+    return "".join(pieces)
+
+
+def dumps_toml(
+    document: dict[str, Any],
+    original: str | None = None,
+    original_document: dict[str, Any] | None = None,
+) -> str:
+    """Serialize a document, preserving the formatting of the original text.
+
+    original_document is what the original text parses to, if already known.
+    """
+    if original is not None:
+        try:
+            patched = patch_toml(original, document, original_document)
+            if patched is not None:
+                return patched
+        except (ValueError, IndexError):
+            pass
+    dumped = toml.dumps(document)
+    return dumped.replace("\n", "\r\n") if original and "\r\n" in original else dumped
@@ -4,11 +4,12 @@ from click.testing import CliRunner
 import pytest
 
 from poetry_python_downgrader.cli import main
+from poetry_python_downgrader.read_toml import TomlSource
 
 
 @pytest.fixture
 def mock_read_toml():
-    with patch("poetry_python_downgrader.cli.read_toml") as mock:
+    with patch("poetry_python_downgrader.cli.read_toml_source") as mock:
         yield mock
 
 
@@ -19,9 +20,9 @@ def mock_downgrade_packages():
 
 
 def test_main_unsupported_version(mock_read_toml, mock_downgrade_packages):
-    mock_read_toml.return_value = {
-        "tool": {"poetry": {"dependencies": {"python": "^3.9"}}}
-    }
+    mock_read_toml.return_value = TomlSource(
+        "", {"tool": {"poetry": {"dependencies": {"python": "^3.9"}}}}
+    )
     runner = CliRunner()
     result = runner.invoke(main, ["pyproject.toml", "3.8"])
     assert result.exit_code == 0
@@ -29,9 +30,9 @@ def test_main_unsupported_version(mock_read_toml, mock_downgrade_packages):
 
 
 def test_main_supported_version(mock_read_toml):
-    mock_read_toml.return_value = {
-        "tool": {"poetry": {"dependencies": {"python": "^3.8"}}}
-    }
+    mock_read_toml.return_value = TomlSource(
+        "", {"tool": {"poetry": {"dependencies": {"python": "^3.8"}}}}
+    )
     runner = CliRunner()
     result = runner.invoke(main, ["pyproject.toml", "3.8"])
     assert result.exit_code == 0
@@ -45,9 +46,9 @@ def test_main_invalid_input():
 
 
 def test_main_output_option(mock_read_toml, mock_downgrade_packages, tmp_path):
-    mock_read_toml.return_value = {
-        "tool": {"poetry": {"dependencies": {"python": "^3.9"}}}
-    }
+    mock_read_toml.return_value = TomlSource(
+        "", {"tool": {"poetry": {"dependencies": {"python": "^3.9"}}}}
+    )
     output_file = tmp_path / "output.toml"
     runner = CliRunner()
     result = runner.invoke(main, ["pyproject.toml", "3.8", "-o", str(output_file)])
@@ -56,9 +57,9 @@ def test_main_output_option(mock_read_toml, mock_downgrade_packages, tmp_path):
 
 
 def test_main_in_place_option(mock_read_toml, mock_downgrade_packages, tmp_path):
-    mock_read_toml.return_value = {
-        "tool": {"poetry": {"dependencies": {"python": "^3.9"}}}
-    }
+    mock_read_toml.return_value = TomlSource(
+        "", {"tool": {"poetry": {"dependencies": {"python": "^3.9"}}}}
+    )
     input_file = tmp_path / "pyproject.toml"
     input_file.touch()
     runner = CliRunner()
@@ -66,21 +67,104 @@ def test_main_in_place_option(mock_read_toml, mock_downgrade_packages, tmp_path)
     assert result.exit_code == 0
 
 
+def test_main_explain_stdout_needs_output(mock_read_toml, mock_downgrade_packages):
+    runner = CliRunner()
+    result = runner.invoke(main, ["pyproject.toml", "3.8", "--explain", "-"])
+    assert result.exit_code != 0
+    assert "Cannot write --explain to stdout" in result.output
+    mock_downgrade_packages.assert_not_called()
+
+
+def test_main_explain_stdout_with_output(
+    mock_read_toml, mock_downgrade_packages, tmp_path
+):
+    mock_read_toml.return_value = TomlSource(
+        "", {"tool": {"poetry": {"dependencies": {"python": "^3.9"}}}}
+    )
+    output_file = tmp_path / "output.toml"
+    runner = CliRunner()
+    result = runner.invoke(
+        main, ["pyproject.toml", "3.8", "-o", str(output_file), "--explain", "-"]
+    )
+    assert result.exit_code == 0
+    mock_downgrade_packages.assert_called_with(ANY, "3.8", False, ANY, ANY, ANY, "main")
+
+
+def test_main_names_dependency_groups(mock_read_toml, mock_downgrade_packages):
+    mock_read_toml.return_value = TomlSource(
+        "",
+        {
+            "tool": {
+                "poetry": {
+                    "dependencies": {"python": "^3.9"},
+                    "group": {"dev": {"dependencies": {"pytest": "^8.0"}}},
+                }
+            }
+        },
+    )
+    runner = CliRunner()
+    result = runner.invoke(main, ["pyproject.toml", "3.8"])
+    assert result.exit_code == 0
+    assert [call.args[-1] for call in mock_downgrade_packages.call_args_list] == [
+        "main",
+        "dev",
+    ]
+
+
 def test_main_pin_versions_option(mock_read_toml, mock_downgrade_packages):
-    mock_read_toml.return_value = {
-        "tool": {"poetry": {"dependencies": {"python": "^3.9"}}}
-    }
+    mock_read_toml.return_value = TomlSource(
+        "", {"tool": {"poetry": {"dependencies": {"python": "^3.9"}}}}
+    )
     runner = CliRunner()
     result = runner.invoke(main, ["pyproject.toml", "3.8", "--pin-versions"])
     assert result.exit_code == 0
-    mock_downgrade_packages.assert_called_with(ANY, "3.8", True, ANY)
+    mock_downgrade_packages.assert_called_with(ANY, "3.8", True, ANY, ANY, None, "main")
 
 
 def test_main_no_pin_versions_option(mock_read_toml, mock_downgrade_packages):
-    mock_read_toml.return_value = {
-        "tool": {"poetry": {"dependencies": {"python": "^3.9"}}}
-    }
+    mock_read_toml.return_value = TomlSource(
+        "", {"tool": {"poetry": {"dependencies": {"python": "^3.9"}}}}
+    )
     runner = CliRunner()
     result = runner.invoke(main, ["pyproject.toml", "3.8", "--no-pin-versions"])
     assert result.exit_code == 0
-    mock_downgrade_packages.assert_called_with(ANY, "3.8", False, ANY)
+    mock_downgrade_packages.assert_called_with(
+        ANY, "3.8", False, ANY, ANY, None, "main"
+    )
+
+
+def test_main_preserves_formatting(mock_downgrade_packages, tmp_path):
+    async def downgrade(dependencies, *_):
+        dependencies["python"] = "^3.8"
+
+    mock_downgrade_packages.side_effect = downgrade
+    input_file = tmp_path / "pyproject.toml"
+    input_file.write_text(
+        "[tool.poetry.dependencies]\n"
+        "python = '^3.9'  # supported versions\n"
+        'click = "^8.1.7"\n'
+    )
+    runner = CliRunner()
+    result = runner.invoke(main, [str(input_file), "3.8", "-i"])
+    assert result.exit_code == 0
+    assert input_file.read_text() == (
+        "[tool.poetry.dependencies]\n"
+        "python = '^3.8'  # supported versions\n"
+        'click = "^8.1.7"\n'
+    )
+
+
+def test_main_preserves_crlf(mock_downgrade_packages, tmp_path):
+    async def downgrade(dependencies, *_):
+        dependencies["python"] = "^3.8"
+        dependencies["pytest"] = "^8.2.2"
+
+    mock_downgrade_packages.side_effect = downgrade
+    input_file = tmp_path / "pyproject.toml"
+    input_file.write_bytes(b'[tool.poetry.dependencies]\r\npython = "^3.10"\r\n')
+    runner = CliRunner()
+    result = runner.invoke(main, [str(input_file), "3.8", "-i"])
+    assert result.exit_code == 0
+    assert input_file.read_bytes() == (
+        b'[tool.poetry.dependencies]\r\npython = "^3.8"\r\npytest = "^8.2.2"\r\n'
+    )
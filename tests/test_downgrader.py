@@ -1,14 +1,19 @@
+import io
+import json
 from unittest.mock import patch
 
 import pytest
 
 from poetry_python_downgrader.downgrader import (
+    allows_python,
     downgrade_packages,
     get_constraint,
     min_version,
+    prune_dependencies,
     set_version,
     versions_for_all,
 )
+from poetry_python_downgrader.pypi import PackageInfo, Reason, VersionLookup
 
 
 def test_get_constraint_string():
@@ -32,11 +37,76 @@ async def test_versions_for_all():
         "python": "^3.8",
     }
     with patch(
-        "poetry_python_downgrader.downgrader.get_compatible_versions"
-    ) as mock_get_compatible_versions:
-        mock_get_compatible_versions.side_effect = ["1.0.1", "2.0.1"]
+        "poetry_python_downgrader.downgrader.lookup_compatible_versions"
+    ) as mock_lookup_compatible_versions:
+        mock_lookup_compatible_versions.side_effect = [
+            [VersionLookup("1.0.1", Reason.FOUND)],
+            [VersionLookup("2.0.1", Reason.FOUND)],
+        ]
         result = await versions_for_all(packages, "3.8")
-    assert result == {"package1": ("^1.0.0", "1.0.1"), "package2": ("^2.0.0", "2.0.1")}
+    assert result == {
+        "package1": [("^1.0.0", ("1.0.1", Reason.FOUND))],
+        "package2": [("^2.0.0", ("2.0.1", Reason.FOUND))],
+    }
+
+
+@pytest.mark.asyncio
+async def test_versions_for_all_multiple_constraints():
+    packages = {
+        "package": [
+            {"version": "^2.0.0", "python": ">=3.8"},
+            {"path": "../package", "python": "<3.8"},
+            {"version": "^1.0.0", "markers": "sys_platform == 'win32'"},
+        ],
+        "local": {"path": "../local"},
+    }
+    with patch(
+        "poetry_python_downgrader.downgrader.lookup_compatible_versions"
+    ) as mock_lookup_compatible_versions:
+        mock_lookup_compatible_versions.return_value = [
+            VersionLookup("2.0.1", Reason.FOUND),
+            VersionLookup("1.0.1", Reason.FOUND),
+        ]
+        result = await versions_for_all(packages, "3.8")
+    mock_lookup_compatible_versions.assert_called_once()
+    assert result == {
+        "package": [
+            ("^2.0.0", ("2.0.1", Reason.FOUND)),
+            None,
+            ("^1.0.0", ("1.0.1", Reason.FOUND)),
+        ],
+        "local": [None],
+    }
+
+
+def test_allows_python():
+    assert allows_python("^1.0.0", "3.8")
+    assert allows_python({"version": "^1.0.0", "python": "^3.8"}, "3.8")
+    assert not allows_python({"version": "^1.0.0", "python": ">=3.9"}, "3.8")
+    assert not allows_python(
+        {"version": "^1.0.0", "markers": "python_version >= '3.9'"}, "3.8"
+    )
+    assert allows_python(
+        {"version": "^1.0.0", "markers": "python_version >= '3.9' or os_name == 'nt'"},
+        "3.8",
+    )
+
+
+def test_prune_dependencies():
+    dependencies = {
+        "python": "^3.9",
+        "package": [
+            {"version": "^2.0.0", "python": ">=3.9"},
+            {"version": "^1.0.0", "python": "<3.9"},
+        ],
+        "new": {"version": "^1.0.0", "python": ">=3.10"},
+        "git": {"git": "https://example.com/git.git", "python": ">=3.10"},
+    }
+    prune_dependencies(dependencies, "3.8")
+    assert dependencies == {
+        "python": "^3.9",
+        "package": [{"version": "^1.0.0", "python": "<3.9"}],
+    }
 
 
 def test_set_version_string():
@@ -45,6 +115,12 @@ def test_set_version_string():
     assert dependencies["package"] == "^1.1.0"
 
 
+def test_set_version_branch():
+    dependencies = {"package": [{"version": "^1.0.0"}, {"version": "^2.0.0"}]}
+    set_version(dependencies, "package", "^2.1.0", 1)
+    assert dependencies["package"][1]["version"] == "^2.1.0"
+
+
 def test_set_version_dict():
     dependencies = {"package": {"version": "^1.0.0"}}
     set_version(dependencies, "package", "^1.1.0")
@@ -58,13 +134,52 @@ async def test_downgrade_packages():
         "poetry_python_downgrader.downgrader.versions_for_all"
     ) as mock_versions_for_all:
         mock_versions_for_all.return_value = {
-            "package1": ("^1.0.0", "1.0.1"),
-            "package2": ("^2.0.0", None),
+            "package1": [("^1.0.0", VersionLookup("1.0.1", Reason.FOUND))],
+            "package2": [("^2.0.0", VersionLookup(None, Reason.NO_COMPATIBLE_RELEASE))],
         }
         await downgrade_packages(dependencies, "3.8")
     assert dependencies == {"package1": "^1.0.1", "python": "^3.8"}
 
 
+@pytest.mark.asyncio
+async def test_downgrade_packages_lookup_reasons():
+    dependencies = {"missing": "^1.0.0", "flaky": "^2.0.0", "python": "^3.9"}
+    with patch(
+        "poetry_python_downgrader.downgrader.versions_for_all"
+    ) as mock_versions_for_all:
+        mock_versions_for_all.return_value = {
+            "missing": [("^1.0.0", VersionLookup(None, Reason.NOT_FOUND))],
+            "flaky": [("^2.0.0", VersionLookup(None, Reason.LOOKUP_FAILED))],
+        }
+        await downgrade_packages(dependencies, "3.8")
+    assert dependencies == {"flaky": "^2.0.0", "python": "^3.8"}
+
+
+@pytest.mark.asyncio
+async def test_downgrade_packages_multiple_constraints():
+    dependencies = {
+        "package": [
+            {"version": "^2.0.0", "markers": "sys_platform == 'linux'"},
+            {"version": "^1.0.0", "markers": "sys_platform == 'win32'"},
+            {"version": "^3.0.0", "python": ">=3.10"},
+        ],
+        "python": "^3.9",
+    }
+    with patch(
+        "poetry_python_downgrader.downgrader.lookup_compatible_versions"
+    ) as mock_lookup_compatible_versions:
+        mock_lookup_compatible_versions.return_value = [
+            VersionLookup("2.0.1", Reason.FOUND),
+            VersionLookup(None, Reason.NO_COMPATIBLE_RELEASE),
+        ]
+        await downgrade_packages(dependencies, "3.8")
+    mock_lookup_compatible_versions.assert_called_once()
+    assert dependencies == {
+        "package": [{"version": "^2.0.1", "markers": "sys_platform == 'linux'"}],
+        "python": "^3.8",
+    }
+
+
 @pytest.mark.asyncio
 async def test_downgrade_packages_pin_version():
     dependencies = {"package1": "^1.0.0", "python": "^3.9"}
@@ -72,7 +187,54 @@ async def test_downgrade_packages_pin_version():
         "poetry_python_downgrader.downgrader.versions_for_all"
     ) as mock_versions_for_all:
         mock_versions_for_all.return_value = {
-            "package1": ("^1.0.0", "1.0.1"),
+            "package1": [("^1.0.0", VersionLookup("1.0.1", Reason.FOUND))],
         }
         await downgrade_packages(dependencies, "3.8", pin_version=True)
     assert dependencies == {"package1": "1.0.1", "python": "^3.8"}
+
+
+@pytest.mark.asyncio
+async def test_downgrade_packages_explain():
+    dependencies = {
+        "package": "^2.0.0",
+        "new": {"version": "^1.0.0", "python": ">=3.9"},
+        "local": {"path": "../local"},
+        "python": "^3.9",
+    }
+    package_info = PackageInfo(
+        {
+            "releases": {
+                "1.0.0": [{"requires_python": ">=3.6"}],
+                "2.0.0": [{"requires_python": ">=3.9"}],
+            }
+        },
+        Reason.FOUND,
+    )
+
+    explain = io.StringIO()
+    with patch(
+        "poetry_python_downgrader.pypi.fetch_package_info", return_value=package_info
+    ):
+        await downgrade_packages(dependencies, "3.8", explain=explain)
+    records = [json.loads(line) for line in explain.getvalue().splitlines()]
+    assert records[0]["package"] == "new"
+    assert records[0]["decision"] == "remove"
+    assert records[0]["reason"] == "python_excluded"
+    assert records[1].pop("fetch_seconds") >= 0
+    assert records[1].pop("evaluate_seconds") >= 0
+    assert records[1] == {
+        "package": "package",
+        "group": "main",
+        "constraint": "^2.0.0",
+        "python": "3.8",
+        "decision": "downgrade",
+        "reason": "found",
+        "candidates": ["2.0.0", "1.0.0"],
+        "first_rejected": {"version": "2.0.0", "requires_python": ">=3.9"},
+        "selected": "1.0.0",
+        "fetch_shared": False,
+    }
+    assert records[2]["package"] == "local"
+    assert records[2]["decision"] == "keep"
+    assert records[2]["reason"] == "not_from_repository"
+    assert records[2]["candidates"] == []
@@ -0,0 +1,64 @@
+from unittest.mock import ANY, patch
+
+from click.testing import CliRunner
+import pytest
+
+from poetry_python_downgrader.prefetch_cli import get_package_names, main
+from poetry_python_downgrader.pypi import PrefetchStats
+
+
+@pytest.fixture
+def mock_prefetch_package_info():
+    with patch("poetry_python_downgrader.prefetch_cli.prefetch_package_info") as mock:
+        mock.return_value = PrefetchStats(
+            packages=2, downloaded_bytes=2_000_000, seconds=1.0
+        )
+        yield mock
+
+
+def test_get_package_names():
+    pyproject = {
+        "tool": {
+            "poetry": {
+                "dependencies": {
+                    "python": "^3.8",
+                    "click": "^8.1.7",
+                    "local": {"path": "../local"},
+                    "multi": [{"git": "https://example.com/multi.git"}],
+                },
+                "group": {"dev": {"dependencies": {"pytest": "^8.2.2"}}},
+            }
+        }
+    }
+    assert get_package_names(pyproject) == {"click", "pytest"}
+
+
+def test_main_prefetch(mock_prefetch_package_info, tmp_path):
+    pyproject = tmp_path / "pyproject.toml"
+    pyproject.write_text('[tool.poetry.dependencies]\npython = "^3.8"\nclick = "*"\n')
+    package_list = tmp_path / "packages.txt"
+    package_list.write_text("numpy  # comment\n\n")
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        [
+            str(pyproject),
+            "-p",
+            "requests",
+            "-l",
+            str(package_list),
+            "--cache-dir",
+            str(tmp_path / "cache"),
+        ],
+    )
+    assert result.exit_code == 0
+    mock_prefetch_package_info.assert_called_with(
+        {"click", "numpy", "requests"}, tmp_path / "cache", ANY, 64
+    )
+    assert "2.0 packages/s, 2.00 MB/s" in result.output
+
+
+def test_main_no_packages(tmp_path):
+    runner = CliRunner()
+    result = runner.invoke(main, ["--cache-dir", str(tmp_path)])
+    assert result.exit_code != 0
@@ -1,14 +1,30 @@
+import os
+import time
+
 from aiohttp import web
 from poetry.core.constraints.version import Version
 import pytest
 
 from poetry_python_downgrader.pypi import (
+    LookupTracer,
+    MetadataCache,
+    Reason,
+    cache_path,
+    fetch_package_info,
     filter_compatible_versions,
     filter_max_version,
     get_compatible_versions,
     get_highest_version,
+    get_requires_python,
     is_version_compatible,
+    lookup_compatible_version,
+    lookup_compatible_versions,
     parse_version,
+    prefetch_package_info,
+    read_cached_info,
+    read_cached_reason,
+    write_cached_info,
+    write_cached_reason,
 )
 
 
@@ -25,10 +41,15 @@ async def mock_package_info(request):
     )
 
 
+async def mock_login_page(request):
+    return web.Response(text="<html>Please log in</html>", content_type="text/html")
+
+
 @pytest.fixture
 def cli(loop, aiohttp_client):
     app = web.Application()
     app.router.add_get("/pypi/package/json", mock_package_info)
+    app.router.add_get("/pypi/login/json", mock_login_page)
 
     return loop.run_until_complete(aiohttp_client(app))
 
@@ -74,3 +95,215 @@ async def test_get_compatible_versions(cli):
         "package", Version.parse("1.1.0"), "3.7", cli.make_url("/pypi")
     )
     assert result == "1.0.0"
+
+
+def test_cache_path(tmp_path):
+    assert cache_path(tmp_path, "My_Package") == cache_path(tmp_path, "my-package")
+    assert cache_path(tmp_path, "package", "https://a.example.com") != cache_path(
+        tmp_path, "package", "https://b.example.com"
+    )
+
+
+def test_cached_info_roundtrip(tmp_path):
+    assert read_cached_info(tmp_path, "package") is None
+    write_cached_info(tmp_path, "package", b'{"releases": {}}')
+    assert read_cached_info(tmp_path, "package") == {"releases": {}}
+    assert read_cached_info(tmp_path, "package", ttl=-1) is None
+    write_cached_info(tmp_path, "package", b"<html></html>")
+    assert read_cached_info(tmp_path, "package") is None
+
+
+def test_cache_write_failures_are_ignored(tmp_path):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    write_cached_info(not_a_dir, "package", b'{"releases": {}}')
+    write_cached_reason(not_a_dir, "package", Reason.NOT_FOUND)
+    assert read_cached_info(not_a_dir, "package") is None
+    assert read_cached_reason(not_a_dir, "package") is None
+
+
+@pytest.mark.asyncio
+async def test_fetch_package_info_uses_cache(tmp_path):
+    repository = "http://127.0.0.1:9/pypi"
+    write_cached_info(tmp_path, "package", b'{"releases": {}}', repository)
+    assert await fetch_package_info("package", repository, MetadataCache(tmp_path)) == (
+        {"releases": {}},
+        Reason.FOUND,
+    )
+
+
+def test_cached_reason_expires(tmp_path):
+    write_cached_reason(tmp_path, "package", Reason.NOT_FOUND)
+    assert read_cached_reason(tmp_path, "package") is Reason.NOT_FOUND
+    assert read_cached_reason(tmp_path, "package", ttl=-1) is None
+    write_cached_info(tmp_path, "package", b'{"releases": {}}')
+    assert read_cached_reason(tmp_path, "package") is None
+
+
+@pytest.mark.asyncio
+async def test_lookup_compatible_version_reasons(cli, tmp_path):
+    repository = str(cli.make_url("/pypi"))
+    cache = MetadataCache(tmp_path)
+    assert await lookup_compatible_version(
+        "package", None, "3.4", repository, cache
+    ) == (None, Reason.NO_COMPATIBLE_RELEASE)
+    assert await lookup_compatible_version(
+        "missing", None, "3.8", repository, cache
+    ) == (None, Reason.NOT_FOUND)
+    assert read_cached_reason(tmp_path, "missing", repository) is Reason.NOT_FOUND
+    assert await lookup_compatible_version(
+        "package", None, "3.8", "http://127.0.0.1:9/pypi", cache
+    ) == (None, Reason.LOOKUP_FAILED)
+    assert read_cached_reason(tmp_path, "package", "http://127.0.0.1:9/pypi") is None
+
+
+@pytest.mark.asyncio
+async def test_lookup_with_unwritable_cache(cli, tmp_path):
+    repository = str(cli.make_url("/pypi"))
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    cache = MetadataCache(not_a_dir)
+    assert await lookup_compatible_version(
+        "missing", None, "3.8", repository, cache
+    ) == (None, Reason.NOT_FOUND)
+    info, reason = await fetch_package_info("package", repository, cache)
+    assert info is not None
+    assert reason is Reason.FOUND
+
+
+@pytest.mark.asyncio
+async def test_fetch_package_info_invalid_json(cli, tmp_path):
+    repository = str(cli.make_url("/pypi"))
+    assert await fetch_package_info("login", repository, MetadataCache(tmp_path)) == (
+        None,
+        Reason.LOOKUP_FAILED,
+    )
+    assert not cache_path(tmp_path, "login", repository).exists()
+    assert read_cached_reason(tmp_path, "login", repository) is None
+
+
+@pytest.mark.asyncio
+async def test_negative_cache_bypass(tmp_path):
+    repository = "http://127.0.0.1:9/pypi"
+    write_cached_reason(tmp_path, "package", Reason.NOT_FOUND, repository)
+    assert await fetch_package_info("package", repository, MetadataCache(tmp_path)) == (
+        None,
+        Reason.NOT_FOUND,
+    )
+    assert await fetch_package_info(
+        "package", repository, MetadataCache(tmp_path, use_negative_cache=False)
+    ) == (None, Reason.LOOKUP_FAILED)
+
+
+OUTDATED_INFO = b'{"releases": {"0.1.0": [{"requires_python": ">=3.9"}]}}'
+
+
+@pytest.mark.asyncio
+async def test_no_compatible_release_expires(cli, tmp_path):
+    repository = str(cli.make_url("/pypi"))
+    write_cached_info(tmp_path, "package", OUTDATED_INFO, repository)
+    assert await lookup_compatible_version(
+        "package", None, "3.8", repository, MetadataCache(tmp_path)
+    ) == (None, Reason.NO_COMPATIBLE_RELEASE)
+
+    two_hours_ago = time.time() - 2 * 60 * 60
+    os.utime(
+        cache_path(tmp_path, "package", repository), (two_hours_ago, two_hours_ago)
+    )
+    assert await lookup_compatible_version(
+        "package", None, "3.8", repository, MetadataCache(tmp_path)
+    ) == ("2.0.0", Reason.FOUND)
+    assert "2.0.0" in read_cached_info(tmp_path, "package", repository)["releases"]
+
+
+@pytest.mark.asyncio
+async def test_no_compatible_release_bypass(cli, tmp_path):
+    repository = str(cli.make_url("/pypi"))
+    write_cached_info(tmp_path, "package", OUTDATED_INFO, repository)
+    cache = MetadataCache(tmp_path, use_negative_cache=False)
+    tracer = LookupTracer()
+    assert await tracer.lookup("package", [None], "3.8", repository, cache) == [
+        ("2.0.0", Reason.FOUND)
+    ]
+    assert await lookup_compatible_version(
+        "package", None, "3.8", repository, cache
+    ) == ("2.0.0", Reason.FOUND)
+
+
+@pytest.mark.asyncio
+async def test_prefetch_package_info(cli, tmp_path):
+    repository = str(cli.make_url("/pypi"))
+    stats = await prefetch_package_info(
+        ["package", "missing", "login"], tmp_path, repository
+    )
+    assert stats.packages == 1
+    assert stats.failed == 2
+    assert stats.downloaded_bytes > 0
+    assert read_cached_info(tmp_path, "package", repository)["releases"]
+    assert read_cached_info(tmp_path, "missing", repository) is None
+    assert read_cached_reason(tmp_path, "missing", repository) is Reason.NOT_FOUND
+    assert read_cached_info(tmp_path, "login", repository) is None
+    assert not cache_path(tmp_path, "login", repository).exists()
+
+
+@pytest.mark.asyncio
+async def test_lookup_compatible_versions(cli):
+    result = await lookup_compatible_versions(
+        "package",
+        [Version.parse("1.1.0"), None, Version.parse("0.1.0")],
+        "3.8",
+        cli.make_url("/pypi"),
+    )
+    assert result == [
+        ("1.1.0", Reason.FOUND),
+        ("2.0.0", Reason.FOUND),
+        (None, Reason.NO_COMPATIBLE_RELEASE),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_lookup_tracer(cli):
+    tracer = LookupTracer()
+    await tracer.lookup(
+        "package",
+        [Version.parse("1.1.0"), Version.parse("0.1.0")],
+        "3.7",
+        cli.make_url("/pypi"),
+    )
+    traces = tracer.traces["package"]
+    assert [
+        {key: trace[key] for key in ("candidates", "first_rejected", "selected")}
+        for trace in traces
+    ] == [
+        {
+            "candidates": ["1.1.0", "1.0.0"],
+            "first_rejected": {"version": "1.1.0", "requires_python": ">=3.8"},
+            "selected": "1.0.0",
+        },
+        {"candidates": [], "first_rejected": None, "selected": None},
+    ]
+    assert traces[0]["fetch_seconds"] > 0
+    assert traces[0]["evaluate_seconds"] > 0
+    assert not traces[0]["fetch_shared"]
+    assert traces[1]["fetch_seconds"] == traces[1]["evaluate_seconds"] == 0
+    assert traces[1]["fetch_shared"]
+
+
+@pytest.mark.asyncio
+async def test_lookup_tracer_shared_fetch(cli):
+    cache = MetadataCache()
+    main, dev = LookupTracer(), LookupTracer()
+    repository = cli.make_url("/pypi")
+    await main.lookup("package", [None], "3.8", repository, cache)
+    await dev.lookup("package", [None], "3.8", repository, cache)
+    assert not main.traces["package"][0]["fetch_shared"]
+    assert dev.traces["package"][0]["fetch_shared"]
+    assert dev.traces["package"][0]["fetch_seconds"] == 0
+
+
+def test_get_requires_python():
+    assert get_requires_python([]) is None
+    assert (
+        get_requires_python([{"requires_python": ">=3.8"}, {"requires_python": None}])
+        == ">=3.8"
+    )
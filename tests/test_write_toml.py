@@ -0,0 +1,181 @@
+import pytest
+
+from poetry_python_downgrader.read_toml import loads_toml
+from poetry_python_downgrader.write_toml import (
+    ScanError,
+    check_values,
+    dumps_toml,
+    patch_toml,
+    render_value,
+    scan_document,
+)
+
+PYPROJECT = """# Project metadata
+[tool.poetry]
+name = "test-project"  # keep me
+
+[tool.poetry.dependencies]
+python = "^3.10"
+numpy = '^2.0.0'
+requests = { version = "^2.31", extras = ["socks"] }
+removed = "^1.0"
+multi = [
+    { version = "^1.0", python = ">=3.10" },
+    { version = "^0.9", python = "<3.10" },
+]
+
+[tool.poetry.dependencies.table]
+version = "^3.0"
+
+[tool.poetry.group.dev.dependencies]
+pytest = "^8.2.2"
+
+[[tool.poetry.source]]
+name = "private"
+url = "https://example.com/simple"
+"""
+
+PATCHED = """# Project metadata
+[tool.poetry]
+name = "test-project"  # keep me
+
+[tool.poetry.dependencies]
+python = "^3.8"
+numpy = '1.24.4'
+requests = { version = "^2.30", extras = ["socks"] }
+
+[tool.poetry.dependencies.table]
+version = "^2.0"
+
+[tool.poetry.group.dev.dependencies]
+pytest = "^8.2.2"
+python = "^3.8"
+
+[[tool.poetry.source]]
+name = "private"
+url = "https://example.com/simple"
+"""
+
+
+def updated_pyproject():
+    pyproject = loads_toml(PYPROJECT)
+    dependencies = pyproject["tool"]["poetry"]["dependencies"]
+    dependencies["python"] = "^3.8"
+    dependencies["numpy"] = "1.24.4"
+    dependencies["requests"]["version"] = "^2.30"
+    dependencies["table"]["version"] = "^2.0"
+    del dependencies["removed"]
+    del dependencies["multi"]
+    pyproject["tool"]["poetry"]["group"]["dev"]["dependencies"]["python"] = "^3.8"
+    return pyproject
+
+
+def test_scan_document():
+    sections = scan_document(PYPROJECT)
+    assert [section.path for section in sections] == [
+        (),
+        ("tool", "poetry"),
+        ("tool", "poetry", "dependencies"),
+        ("tool", "poetry", "dependencies", "table"),
+        ("tool", "poetry", "group", "dev", "dependencies"),
+        ("tool", "poetry", "source"),
+    ]
+    multi = sections[2].entries[4]
+    assert multi.path == ("multi",)
+    assert PYPROJECT[multi.value_start : multi.value_end].endswith("},\n]")
+
+
+def test_render_value():
+    assert render_value("^1.0") == '"^1.0"'
+    assert render_value(True) == "true"
+    assert render_value(["a", 1]) == '["a", 1]'
+    assert render_value({"version": "^1.0", "my key": 1}) == (
+        '{ version = "^1.0", "my key" = 1 }'
+    )
+
+
+def test_patch_toml_preserves_formatting():
+    assert patch_toml(PYPROJECT, updated_pyproject()) == PATCHED
+
+
+def test_patch_toml_keeps_crlf():
+    text = PYPROJECT.replace("\n", "\r\n")
+    original = loads_toml(text)
+    assert patch_toml(text, updated_pyproject(), original) == PATCHED.replace(
+        "\n", "\r\n"
+    )
+
+
+def test_patch_toml_removes_tables():
+    pyproject = updated_pyproject()
+    del pyproject["tool"]["poetry"]["dependencies"]["table"]
+    patched = patch_toml(PYPROJECT, pyproject)
+    assert "[tool.poetry.dependencies.table]" not in patched
+    assert loads_toml(patched) == pyproject
+
+
+def test_patch_toml_keeps_comments_of_next_table():
+    text = """[tool.poetry.group.old.dependencies]
+foo = "^1.0"
+
+# Dev tools section
+[tool.poetry.group.dev.dependencies]
+pytest = "^8.2.2"
+"""
+    pyproject = loads_toml(text)
+    del pyproject["tool"]["poetry"]["group"]["old"]
+    assert patch_toml(text, pyproject) == text[text.index("\n\n") + 1 :]
+
+
+def test_patch_toml_updates_multiple_constraints_in_place():
+    text = (
+        "[tool.poetry.dependencies]\n"
+        "numpy = [\n"
+        "  # modern\n"
+        '  {version="^2.0.0", python=">=3.9"},\n'
+        "  # legacy\n"
+        '  {version="^1.26.0", markers="sys_platform == \'linux\'"},  # pinned\n'
+        "]\n"
+        'scipy = [{version="^1.13", python=">=3.9"}, {version="^1.10", python="<3.9"}]\n'
+    )
+    pyproject = loads_toml(text)
+    dependencies = pyproject["tool"]["poetry"]["dependencies"]
+    dependencies["numpy"] = [{**dependencies["numpy"][1], "version": "^1.24.0"}]
+    dependencies["scipy"] = dependencies["scipy"][:1]
+    assert patch_toml(text, pyproject) == (
+        "[tool.poetry.dependencies]\n"
+        "numpy = [\n"
+        "  # modern\n"
+        "  # legacy\n"
+        '  {version="^1.24.0", markers="sys_platform == \'linux\'"},  # pinned\n'
+        "]\n"
+        'scipy = [{version="^1.13", python=">=3.9"}]\n'
+    )
+
+
+def test_check_values():
+    check_values(
+        [(0, '"^1.0"', "^1.0"), (10, '{ version = "^1.0" }', {"version": "^1.0"})]
+    )
+    with pytest.raises(ScanError):
+        check_values([(0, '"^1.0"', "^2.0")])
+    with pytest.raises(ScanError):
+        check_values([(0, "[1, 2]", [1])])
+
+
+def test_patch_toml_rejects_missed_keys():
+    text = 'a = 1\nb = """\nc = 2\n"""\n'
+    pyproject = loads_toml(text)
+    pyproject["a"] = 3
+    with pytest.raises(ScanError):
+        patch_toml(text, pyproject, {"a": 1, "b": "c = 2\n", "d": 4})
+
+
+def test_dumps_toml_unchanged():
+    assert dumps_toml(loads_toml(PYPROJECT), PYPROJECT) == PYPROJECT
+
+
+def test_dumps_toml_falls_back_to_full_dump():
+    pyproject = {"tool": {"poetry": {"dependencies": {"python": "^3.8"}}}}
+    assert loads_toml(dumps_toml(pyproject, "")) == pyproject
+    assert loads_toml(dumps_toml(pyproject)) == pyproject